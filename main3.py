@@ -1,11 +1,16 @@
 import cv2
 import face_recognition
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import sqlite3
 import csv
 import smtplib
 import os
 import pyttsx3
+import time
+from collections import deque
 from datetime import datetime
 from tkinter import *
 from tkinter import ttk, messagebox
@@ -15,6 +20,27 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Columnar archive of closed attendance days, partitioned by date/department
+ARCHIVE_DIR = 'attendance_archive'
+ATTENDANCE_COLUMNS = ['name', 'roll_no', 'department', 'date', 'time']
+ARCHIVE_SCHEMA = pa.schema([(col, pa.string()) for col in ATTENDANCE_COLUMNS])
+ARCHIVE_PARTITIONING = ds.partitioning(
+    pa.schema([('date', pa.string()), ('department', pa.string())]),
+    flavor='hive'
+)
+
+# Optional liveness (anti-spoofing) check run on the preview frames before encoding.
+# Off by default; set LIVENESS_CHECK=1 to enable. While enabled, attendance is taken
+# one person at a time and captures with more than one face are refused.
+LIVENESS_ENABLED = os.getenv("LIVENESS_CHECK", "0") == "1"
+LIVENESS_FRAMES = 90
+LIVENESS_CROP_SIZE = 128
+LIVENESS_MIN_TEXTURE = 40.0
+LIVENESS_MIN_BLINK_FRAMES = 2
+LIVENESS_MAX_BLINK_FRAMES = 12
+LIVENESS_MAX_MISSED_FRAMES = 3
+LIVENESS_MIN_IOU = 0.3
+
 # Initialize database
 def init_db():
     conn = sqlite3.connect('attendance.db')
@@ -73,8 +99,52 @@ for filename in os.listdir(known_faces_dir):
             known_departments.append(details.get("department", "N/A"))
             known_emails.append(details.get("email", ""))
 
+# Overlap (intersection over union) of two (x, y, w, h) boxes
+def box_iou(a, b):
+    ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+# Crops of one face followed across consecutive preview frames for the liveness check
+class FaceTrack:
+    def __init__(self):
+        self.crops = deque(maxlen=LIVENESS_FRAMES)
+        self.box = None
+        self.missed = 0
+        
+    def reset(self):
+        self.crops.clear()
+        self.box = None
+        self.missed = 0
+        
+    def update(self, gray, faces):
+        # A second face, or the face going missing for a while, breaks the track
+        if len(faces) != 1:
+            self.missed += 1
+            if len(faces) > 1 or self.missed > LIVENESS_MAX_MISSED_FRAMES:
+                self.reset()
+            return
+        
+        box = tuple(int(v) for v in faces[0])
+        # A jump to a different place in the frame is treated as a different face
+        if self.box is not None and box_iou(box, self.box) < LIVENESS_MIN_IOU:
+            self.reset()
+        x, y, w, h = box
+        self.crops.append(cv2.resize(gray[y:y+h, x:x+w], (LIVENESS_CROP_SIZE, LIVENESS_CROP_SIZE)))
+        self.box = box
+        self.missed = 0
+        
+    def matches(self, face_location):
+        # face_recognition locations are (top, right, bottom, left)
+        if self.box is None or self.missed:
+            return False
+        top, right, bottom, left = face_location
+        return box_iou((left, top, right - left, bottom - top), self.box) >= LIVENESS_MIN_IOU
+
 # Enhanced Image capture with real-time detection
-def capture_image():
+def capture_image(track=None):
     cam = cv2.VideoCapture(0)
     face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
     
@@ -86,6 +156,9 @@ def capture_image():
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         faces = face_cascade.detectMultiScale(gray, 1.3, 5)
         
+        if track is not None:
+            track.update(gray, faces)
+        
         for (x, y, w, h) in faces:
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
         
@@ -101,9 +174,44 @@ def capture_image():
     cv2.destroyAllWindows()
     return frame
 
+# Cheap CPU liveness check: require a blink across the face crops from the preview
+def check_liveness(face_crops):
+    if len(face_crops) < 3 * LIVENESS_MIN_BLINK_FRAMES:
+        return False
+    start = time.perf_counter()
+    
+    # Texture: a cheap gate against flat prints; on its own it cannot prove liveness
+    texture = float(np.median([cv2.Laplacian(c, cv2.CV_64F).var() for c in face_crops]))
+    
+    # Blink: eyes seen, then missing for a short run of consecutive frames, then seen again.
+    # A single frame without eyes is treated as a cascade miss, not a blink.
+    blinked = False
+    if texture >= LIVENESS_MIN_TEXTURE:
+        eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+        eyes = np.array([len(eye_cascade.detectMultiScale(c[:LIVENESS_CROP_SIZE // 2], 1.1, 3)) > 0
+                         for c in face_crops])
+        i = 0
+        while i < len(eyes) and not blinked:
+            if eyes[i]:
+                i += 1
+                continue
+            j = i
+            while j < len(eyes) and not eyes[j]:
+                j += 1
+            blinked = (LIVENESS_MIN_BLINK_FRAMES <= j - i <= LIVENESS_MAX_BLINK_FRAMES
+                       and eyes[:i].sum() >= LIVENESS_MIN_BLINK_FRAMES
+                       and eyes[j:].sum() >= LIVENESS_MIN_BLINK_FRAMES)
+            i = j
+    
+    live = texture >= LIVENESS_MIN_TEXTURE and blinked
+    per_frame_ms = (time.perf_counter() - start) * 1000 / len(face_crops)
+    print(f"Liveness check: {per_frame_ms:.2f} ms/frame over {len(face_crops)} frames "
+          f"(texture={texture:.1f}, blink={blinked}, live={live})")
+    return live
+
 # Face recognition with confidence threshold
-def recognize_faces(captured_image, tolerance=0.6):
-    face_encodings = face_recognition.face_encodings(captured_image)
+def recognize_faces(captured_image, tolerance=0.6, face_locations=None):
+    face_encodings = face_recognition.face_encodings(captured_image, face_locations)
     if not face_encodings:
         return []
         
@@ -143,32 +251,242 @@ def mark_attendance_db(student_name, roll_no, department):
     finally:
         conn.close()
 
-# Enhanced Report generation
-def generate_report(date=None, department=None, output_format='excel'):
+# Move closed days (before today) from SQLite into the Parquet archive
+def archive_closed_days(archive_dir=ARCHIVE_DIR, chunksize=50000):
+    today = datetime.now().strftime("%Y-%m-%d")
     conn = sqlite3.connect('attendance.db')
-    query = "SELECT * FROM attendance"
+    try:
+        # A run only counts once it is recorded here, in the same commit as the DELETE
+        conn.execute("""CREATE TABLE IF NOT EXISTS archive_runs
+                        (run_id TEXT PRIMARY KEY, rows INTEGER)""")
+        committed = {row[0] for row in conn.execute("SELECT run_id FROM archive_runs")}
+
+        # Files from a run that died before its commit still have their rows in SQLite,
+        # so drop them before archiving those rows again
+        if os.path.isdir(archive_dir):
+            for root, _, files in os.walk(archive_dir):
+                for name in files:
+                    if name.startswith('part-') and name.split('-')[1] not in committed:
+                        os.remove(os.path.join(root, name))
+
+        run_id = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        archived = 0
+        last_id = None
+        chunks = pd.read_sql(f"SELECT id, {', '.join(ATTENDANCE_COLUMNS)} FROM attendance "
+                             "WHERE date < ? ORDER BY id", conn, params=(today,), chunksize=chunksize)
+        for chunk_no, chunk in enumerate(chunks):
+            last_id = int(chunk['id'].iloc[-1])
+            # The string dtype keeps NULLs as nulls rather than the text 'None'
+            table = pa.Table.from_pandas(chunk[ATTENDANCE_COLUMNS].astype('string'),
+                                         schema=ARCHIVE_SCHEMA, preserve_index=False)
+            ds.write_dataset(table, archive_dir, format='parquet',
+                             partitioning=ARCHIVE_PARTITIONING,
+                             basename_template=f'part-{run_id}-{chunk_no}-{{i}}.parquet',
+                             existing_data_behavior='overwrite_or_ignore')
+            archived += len(chunk)
+        if not archived:
+            return 0
+
+        # Only drop rows from SQLite once they are safely on disk
+        conn.execute("DELETE FROM attendance WHERE date < ? AND id <= ?", (today, last_id))
+        conn.execute("INSERT INTO archive_runs (run_id, rows) VALUES (?, ?)", (run_id, archived))
+        conn.commit()
+        return archived
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return 0
+    except (pa.ArrowException, OSError) as e:
+        print(f"Archive error: {e}")
+        return 0
+    finally:
+        conn.close()
+
+# Open the Parquet archive, or None if nothing has been archived yet
+def open_archive(archive_dir=ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return None
+    return ds.dataset(archive_dir, format='parquet', schema=ARCHIVE_SCHEMA,
+                      partitioning=ARCHIVE_PARTITIONING)
+
+# Load attendance rows from the archive and the live database
+def load_attendance(date=None, department=None, columns=None, archive_dir=ARCHIVE_DIR,
+                    start_date=None, end_date=None):
+    columns = list(columns or ATTENDANCE_COLUMNS)
+    today = datetime.now().strftime("%Y-%m-%d")
+    frames = []
+
+    # Closed days come from the archive, reading only the needed columns and partitions
+    dataset = open_archive(archive_dir) if date != today and (start_date or '') < today else None
+    if dataset is not None:
+        filters = []
+        if date:
+            filters.append(ds.field('date') == date)
+        if start_date:
+            filters.append(ds.field('date') >= start_date)
+        if end_date:
+            filters.append(ds.field('date') <= end_date)
+        if department:
+            filters.append(ds.field('department') == department)
+        expr = None
+        for f in filters:
+            expr = f if expr is None else expr & f
+        frames.append(dataset.to_table(columns=columns, filter=expr).to_pandas())
+
+    # Anything not yet archived (normally just today) still lives in SQLite
+    query = f"SELECT {', '.join(columns)} FROM attendance"
     conditions = []
-    
+    params = []
     if date:
-        conditions.append(f"date = '{date}'")
+        conditions.append("date = ?")
+        params.append(date)
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= ?")
+        params.append(end_date)
     if department:
-        conditions.append(f"department = '{department}'")
-    
+        conditions.append("department = ?")
+        params.append(department)
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
-    
-    df = pd.read_sql(query, conn)
+
+    conn = sqlite3.connect('attendance.db')
+    frames.append(pd.read_sql(query, conn, params=params))
     conn.close()
+
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+# Build a roster x session-date presence matrix (True = present)
+def build_attendance_matrix(start_date=None, end_date=None, department=None, archive_dir=ARCHIVE_DIR):
+    roster = pd.DataFrame(list(load_student_data().values()),
+                          columns=['name', 'roll_no', 'department'])
+    if department:
+        roster = roster[roster['department'] == department]
+    roster = roster.drop_duplicates('roll_no').reset_index(drop=True)
+    roster_index = pd.Index(roster['roll_no'])
+
+    range_filters = []
+    conditions = []
+    params = []
+    if start_date:
+        range_filters.append(ds.field('date') >= start_date)
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        range_filters.append(ds.field('date') <= end_date)
+        conditions.append("date <= ?")
+        params.append(end_date)
+    range_expr = None
+    for f in range_filters:
+        range_expr = f if range_expr is None else range_expr & f
+
+    # Archived partitions in range, read from the directory layout without touching any data
+    fragments = []
+    dataset = open_archive(archive_dir)
+    if dataset is not None:
+        for fragment in dataset.get_fragments(filter=range_expr):
+            keys = ds.get_partition_keys(fragment.partition_expression)
+            if keys.get('date'):
+                fragments.append((fragment, keys['date'], keys.get('department')))
+
+    # A session is any date on which anyone was marked present, whatever the department,
+    # so a day a whole department missed still counts against it
+    conn = sqlite3.connect('attendance.db')
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    live_dates = {row[0] for row in conn.execute(f"SELECT DISTINCT date FROM attendance{where}", params)}
+    dates = sorted({date for _, date, _ in fragments} | live_dates)
+    date_index = pd.Index(dates)
+
+    matrix = np.zeros((len(roster), len(dates)), dtype=bool)
+
+    # Stream just the roll_no column of the department's partitions one batch at a time;
+    # unknown roll numbers get -1 and are dropped
+    for fragment, date, dept in fragments:
+        if department and dept != department:
+            continue
+        col = date_index.get_loc(date)
+        for batch in fragment.to_batches(columns=['roll_no']):
+            rows = roster_index.get_indexer(batch.column('roll_no').to_numpy(zero_copy_only=False))
+            matrix[rows[rows >= 0], col] = True
+
+    # Rows not yet archived (normally just today) come from SQLite in chunks
+    if department:
+        conditions.append("department = ?")
+        params.append(department)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    for chunk in pd.read_sql(f"SELECT roll_no, date FROM attendance{where}", conn,
+                             params=params, chunksize=50000):
+        rows = roster_index.get_indexer(chunk['roll_no'])
+        cols = date_index.get_indexer(chunk['date'])
+        known = rows >= 0
+        matrix[rows[known], cols[known]] = True
+    conn.close()
+    return roster, dates, matrix
+
+# Per-student attendance percentage and absence streaks
+def compute_attendance_summary(start_date=None, end_date=None, department=None):
+    roster, dates, matrix = build_attendance_matrix(start_date, end_date, department)
+    present = matrix.sum(axis=1)
+
+    summary = roster.copy()
+    summary['sessions'] = len(dates)
+    summary['present'] = present
+    summary['absent'] = len(dates) - present
+    summary['attendance_pct'] = np.round(100.0 * present / len(dates), 2) if dates else 0.0
+
+    # Walk the sessions once, updating every student's run of absences together
+    run = np.zeros(len(roster), dtype=np.int32)
+    longest = np.zeros(len(roster), dtype=np.int32)
+    for absent in ~matrix.T:
+        run = (run + 1) * absent
+        np.maximum(longest, run, out=longest)
+    summary['current_absent_streak'] = run
+    summary['longest_absent_streak'] = longest
+    return summary
+
+# Students on the roster with no attendance record for the given date
+def get_absentees(date, department=None):
+    roster, dates, matrix = build_attendance_matrix(date, date, department)
+    # Nobody attended at all, so there was no session (or the date is wrong)
+    if not dates:
+        print(f"No session found on {date}")
+        return roster.iloc[0:0]
+    return roster[~matrix[:, 0]].reset_index(drop=True)
+
+# Write a report DataFrame to a timestamped Excel/CSV file
+def save_report(df, prefix, output_format='excel'):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if output_format == 'excel':
+        report_name = f"{prefix}_{timestamp}.xlsx"
+        df.to_excel(report_name, index=False)
+    else:
+        report_name = f"{prefix}_{timestamp}.csv"
+        df.to_csv(report_name, index=False)
+    return report_name
+
+# Enhanced Report generation
+def generate_report(date=None, department=None, output_format='excel'):
+    df = load_attendance(date, department)
     
     if not df.empty:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        if output_format == 'excel':
-            report_name = f"Attendance_Report_{timestamp}.xlsx"
-            df.to_excel(report_name, index=False)
-        else:
-            report_name = f"Attendance_Report_{timestamp}.csv"
-            df.to_csv(report_name, index=False)
-        return report_name
+        df = df.sort_values(['date', 'time'], ignore_index=True)
+        return save_report(df, "Attendance_Report", output_format)
+    return None
+
+# Absentee list for one date, or per-student summary across all sessions
+def generate_absentee_report(date=None, department=None, output_format='excel'):
+    if date:
+        df = get_absentees(date, department)
+    else:
+        df = compute_attendance_summary(department=department)
+        df = df.sort_values(['attendance_pct', 'roll_no'], ignore_index=True)
+    
+    if not df.empty:
+        return save_report(df, "Absentee_Report", output_format)
     return None
 
 # Secure Email function
@@ -249,7 +567,9 @@ class AttendanceApp:
         ttk.Radiobutton(report_window, text="CSV", variable=self.report_type, value='csv').grid(row=3, column=1)
         
         ttk.Button(report_window, text="Generate", 
-                  command=self.generate_report).grid(row=4, column=0, columnspan=2, pady=10)
+                  command=self.generate_report).grid(row=4, column=0, pady=10)
+        ttk.Button(report_window, text="Absentees", 
+                  command=self.generate_absentee_report).grid(row=4, column=1, pady=10)
         
     def generate_report(self):
         date = self.date_entry.get() or None
@@ -263,17 +583,45 @@ class AttendanceApp:
         else:
             messagebox.showwarning("Warning", "No matching records found")
         
+    def generate_absentee_report(self):
+        date = self.date_entry.get() or None
+        department = self.dept_entry.get() or None
+        output_format = self.report_type.get()
+        
+        report_file = generate_absentee_report(date, department, output_format)
+        if report_file:
+            messagebox.showinfo("Success", f"Report generated: {report_file}")
+            os.startfile(report_file)
+        else:
+            messagebox.showwarning("Warning", "No absentees found (or no session on that date)")
+        
     def take_attendance(self):
         if not self.calibrate_camera():
             messagebox.showerror("Error", "Camera calibration failed. Please check your camera.")
             return
             
-        image = capture_image()
+        track = FaceTrack() if LIVENESS_ENABLED else None
+        image = capture_image(track)
         if image is None:
             messagebox.showwarning("Warning", "No image captured")
             return
             
-        recognized = recognize_faces(image)
+        # Reject spoof attempts with the cheap check before any face detection or encoding.
+        # Only the single tracked face was checked, so the captured face must be that one.
+        face_locations = None
+        if LIVENESS_ENABLED:
+            if not check_liveness(track.crops):
+                messagebox.showwarning("Warning", "Liveness check failed. Please look at the camera and blink")
+                return
+            face_locations = face_recognition.face_locations(image)
+            if len(face_locations) > 1:
+                messagebox.showwarning("Warning", "Multiple faces detected. Please take attendance one person at a time")
+                return
+            if face_locations and not track.matches(face_locations[0]):
+                messagebox.showwarning("Warning", "Captured face does not match the tracked face. Please try again")
+                return
+            
+        recognized = recognize_faces(image, face_locations=face_locations)
         if not recognized:
             messagebox.showwarning("Warning", "No faces recognized")
             return
@@ -317,6 +665,9 @@ class AttendanceApp:
 # Main execution
 if __name__ == "__main__":
     init_db()
+    archived = archive_closed_days()
+    if archived:
+        print(f"Archived {archived} attendance records")
     root = Tk()
     root.geometry("400x200")
     root.resizable(False, False)